@@ -1,5 +1,15 @@
 from pathlib import Path
+import http.server
 import importlib.util
+import mimetypes
+import sys
+import threading
+
+import pytest
+
+
+TESTS_DIR = Path(__file__).resolve().parent
+SCRIPTS_DIR = TESTS_DIR.parent / "transform_md"
 
 
 def load_transform_module(scripts_dir: Path):
@@ -12,11 +22,10 @@ def load_transform_module(scripts_dir: Path):
 
 
 def test_transform_text_basic():
-    scripts_dir = Path(__file__).resolve().parent
-    mod = load_transform_module(scripts_dir)
+    mod = load_transform_module(SCRIPTS_DIR)
 
-    src = scripts_dir / "tests" / "data" / "test_input.md"
-    expected = scripts_dir / "tests" / "data" / "expected_output.md"
+    src = TESTS_DIR / "data" / "test_input.md"
+    expected = TESTS_DIR / "data" / "expected_output.md"
 
     text = src.read_text(encoding="utf-8")
     out = mod.transform_text(text)
@@ -24,8 +33,7 @@ def test_transform_text_basic():
 
 
 def test_transform_file_overwrite(tmp_path: Path):
-    scripts_dir = Path(__file__).resolve().parent
-    mod = load_transform_module(scripts_dir)
+    mod = load_transform_module(SCRIPTS_DIR)
 
     inp = tmp_path / "in.md"
     inp.write_text("Line1\nCode snippet\nLine3\n")
@@ -36,8 +44,7 @@ def test_transform_file_overwrite(tmp_path: Path):
 
 
 def test_transform_code_snippet_with_lang():
-    scripts_dir = Path(__file__).resolve().parent
-    mod = load_transform_module(scripts_dir)
+    mod = load_transform_module(SCRIPTS_DIR)
     src_text = """Title\n\nCode snippet (dot):\n\ndigraph { A -> B }\n\n"""
     out = mod.transform_text(src_text)
     assert "```dot" in out
@@ -46,9 +53,168 @@ def test_transform_code_snippet_with_lang():
 
 
 def test_auto_close_unmatched_fence():
-    scripts_dir = Path(__file__).resolve().parent
-    mod = load_transform_module(scripts_dir)
+    mod = load_transform_module(SCRIPTS_DIR)
     src_text = """Start\n\n```python\nprint(1)\n"""
     out = mod.transform_text(src_text)
     # should close the unclosed python fence
     assert out.strip().endswith('```')
+
+
+def test_transform_crlf_and_unicode_whitespace():
+    mod = load_transform_module(SCRIPTS_DIR)
+    src_text = "Intro\r\n\r\nCode snippet\r\n\r\ngraph TD\r\n\r\n\r\n\r\n\xa0Code snippet (dot)\x0c\r\nA -> B\r\n"
+    out = mod.transform_text(src_text)
+    # CRLF is normalised, NBSP is stripped and \x0c ends a line, as with str.splitlines()
+    assert out == "Intro\n\n```mermaid\n\ngraph TD\n\n```\n\n\n```dot\n\nA -> B\n```\n"
+
+
+def test_collapse_long_blank_run():
+    mod = load_transform_module(SCRIPTS_DIR)
+    out = mod.transform_text("a\n\n\n\n\nb\n")
+    assert out == "a\n\n\nb\n"
+
+
+def test_blank_run_after_mermaid_content():
+    mod = load_transform_module(SCRIPTS_DIR)
+    out = mod.transform_text("Code snippet\ngraph TD\n\n\n\n\nnext\n")
+    # the first blank closes the block; the rest of the run is collapsed
+    assert out == "```mermaid\ngraph TD\n\n```\n\n\nnext\n"
+
+
+def test_whitespace_only_last_line_without_newline():
+    mod = load_transform_module(SCRIPTS_DIR)
+    assert mod.transform_text("a\n\n  ") == "a\n\n"
+    assert mod.transform_text("a\n  \n\n  ") == "a\n\n"
+
+
+def test_collapse_blanks_disabled():
+    mod = load_transform_module(SCRIPTS_DIR)
+    out = mod.transform_text("a\n\n\n\n\nb", enabled=["code_snippet", "close_fences"])
+    assert out == "a\n\n\n\n\nb"
+
+
+IMAGES = {
+    "/pic.png": ("image/png", b"PNGDATA"),
+    "/": ("image/jpeg", b"JPEG"),
+}
+
+
+class _ImageHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        found = IMAGES.get(self.path)
+        if found is None:
+            self.send_error(404)
+            return
+        ctype, body = found
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def image_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("use_session", [True, False])
+def test_download_and_replace_images(tmp_path: Path, image_server: str, use_session: bool):
+    mod = load_transform_module(SCRIPTS_DIR)
+    if use_session:
+        pytest.importorskip("requests")
+        assert mod._get_session() is not None
+    else:
+        mod._get_session = lambda: None  # force the urllib path
+    src_text = (
+        f"![Image of a]({image_server}/pic.png)\n"
+        f"![Image of a again]({image_server}/pic.png)\n"
+        f"![Image of missing]({image_server}/missing.png)\n"
+        f"![Image of root]({image_server}/)\n"
+    )
+    out = mod._download_and_replace_images(src_text, tmp_path)
+
+    hashed = mod._url_hash(f"{image_server}/") + mimetypes.guess_extension("image/jpeg")
+    assert out == (
+        "![Image of](images/pic.png)\n"
+        "![Image of](images/pic.png)\n"  # repeated URLs share one file
+        f"![Image of missing]({image_server}/missing.png)\n"  # 404 left unchanged
+        f"![Image of](images/{hashed})\n"  # no path name: hash plus content-type ext
+    )
+    images = tmp_path / "images"
+    # only the final files: no leftover .part downloads, no pic-1.png copy
+    assert sorted(p.name for p in images.iterdir()) == sorted(["pic.png", hashed])
+    assert (images / "pic.png").read_bytes() == b"PNGDATA"
+    assert (images / hashed).read_bytes() == b"JPEG"
+
+
+def test_write_chunks_short_writes(tmp_path: Path, monkeypatch):
+    mod = load_transform_module(SCRIPTS_DIR)
+    real_write = mod.os.write
+    monkeypatch.setattr(mod.os, "write", lambda fd, data: real_write(fd, bytes(data[:3])))
+    target = tmp_path / "out.bin"
+    mod._write_chunks(target, [b"0123456789", b"", b"abcdefg"])
+    assert target.read_bytes() == b"0123456789abcdefg"
+
+
+def test_cli_indir_serial_and_parallel_match(tmp_path: Path, monkeypatch, capsys):
+    mod = load_transform_module(SCRIPTS_DIR)
+    # worker processes look _process_one up by module name
+    monkeypatch.setitem(sys.modules, "transform_md", mod)
+    monkeypatch.syspath_prepend(str(SCRIPTS_DIR))
+
+    sample = (TESTS_DIR / "data" / "test_input.md").read_text(encoding="utf-8")
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    n_files = mod._PARALLEL_MIN_FILES + 4
+    for i in range(n_files):
+        (in_dir / f"chat{i:02}.md").write_text(f"# Chat {i}\n\n{sample}", encoding="utf-8")
+    small_dir = tmp_path / "small"
+    small_dir.mkdir()
+    (small_dir / "one.md").write_text(sample, encoding="utf-8")
+
+    pools = []
+    real_pool = mod.ProcessPoolExecutor
+
+    def recording_pool(**kwargs):
+        pools.append(kwargs)
+        return real_pool(**kwargs)
+
+    monkeypatch.setattr(mod, "ProcessPoolExecutor", recording_pool)
+
+    def run(cpus: int, src: Path, out_name: str):
+        monkeypatch.setattr(mod.os, "cpu_count", lambda: cpus)
+        out_dir = tmp_path / out_name
+        monkeypatch.setattr(sys, "argv", ["transform-md", "unused.md", "--indir", str(src), "--outdir", str(out_dir)])
+        mod._cli()
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == "Wrote:"
+        names = [Path(w).name for w in lines[1:]]
+        contents = {p.name: p.read_text(encoding="utf-8") for p in out_dir.iterdir()}
+        return names, contents
+
+    serial = run(1, in_dir, "serial")
+    assert pools == []
+
+    # too few files for a pool, even with several CPUs
+    run(4, small_dir, "small_out")
+    assert pools == []
+
+    parallel = run(4, in_dir, "parallel")
+    assert len(pools) == 1
+    assert pools[0]["max_workers"] == 4
+    assert pools[0]["initializer"] is mod._init_worker
+    assert pools[0]["initargs"] == (mod._DOWNLOAD_WORKERS // 4,)
+
+    assert parallel == serial
+    names, contents = serial
+    assert names == [f"chat{i:02}.md" for i in range(n_files)]
+    assert contents["chat03.md"] == mod.transform_text(f"# Chat 3\n\n{sample}")
@@ -7,11 +7,15 @@ starter (```mermaid). It also exposes a small CLI to transform files.
 from __future__ import annotations
 
 import argparse
+import functools
 import re
 import hashlib
 import mimetypes
+import os
 import urllib.request
 import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from typing import Iterable
 
@@ -22,6 +26,64 @@ DEFAULT_TRANSFORMS = [
     "collapse_blanks",
 ]
 
+# `Code snippet` marker lines, optionally with `(lang)` and a trailing colon
+_CODE_SNIP_RE = re.compile(r"^\s*Code snippet(?:\s*\((?P<lang>[^)]+)\))?\s*:?$", re.I)
+
+# default `Code snippet` language, compared case-insensitively
+_MERMAID = "mermaid"
+
+# match alt text starting with 'Image of' (case-insensitive)
+_IMG_RE = re.compile(r"!\[Image of[^\]]*\]\((?P<url>https?://[^)\s]+)\)", re.I)
+
+# max concurrent image downloads
+_DOWNLOAD_WORKERS = 16
+
+# below this many files (or with one CPU) --indir runs serially; a process
+# pool costs more to start than it saves on a few small files
+_PARALLEL_MIN_FILES = 16
+
+# bytes per read when streaming an image to disk
+_CHUNK_SIZE = 64 * 1024
+
+_USER_AGENT = "transform-md/1.0"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_session():
+    """Return a shared keep-alive `requests.Session`, or None without `requests`.
+
+    `requests` is imported on first use so that plain transforms do not pay for it.
+    """
+    try:
+        import requests
+        from requests.adapters import HTTPAdapter
+    except ImportError:  # optional: `pip install transform-md[download]`
+        return None
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = _USER_AGENT
+    return session
+
+
+def _url_hash(url: str) -> str:
+    """Return a short hex name derived from `url`."""
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=5).hexdigest()
+
+
+def _write_chunks(path: Path, chunks: Iterable[bytes]) -> None:
+    """Write `chunks` to `path` with unbuffered `os.write` calls on a raw descriptor."""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o666)
+    try:
+        for chunk in chunks:
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
 
 def transform_text(text: str, enabled: Iterable[str] | None = None) -> str:
     """Transform the input markdown text.
@@ -35,36 +97,72 @@ def transform_text(text: str, enabled: Iterable[str] | None = None) -> str:
     - Auto-closes any unclosed triple-backtick fence at EOF.
     - Collapse runs of more than two consecutive blank lines into two.
     """
-    code_snip_re = re.compile(r"^\s*Code snippet(?:\s*\((?P<lang>[^)]+)\))?\s*:?$", re.I)
-
     enabled_set = set(enabled) if enabled is not None else set(DEFAULT_TRANSFORMS)
+    do_snip = 'code_snippet' in enabled_set
+    do_close = 'close_fences' in enabled_set
+    do_collapse = 'collapse_blanks' in enabled_set
 
     out_lines: list[str] = []
+    # bound once; the loop calls these for every line
+    append = out_lines.append
+    fullmatch = _CODE_SNIP_RE.fullmatch
 
-    mermaid_open = False
-    mermaid_has_content = False
-    generic_fence_open = False
+    mermaid_open: bool = False
+    mermaid_has_content: bool = False
+    generic_fence_open: bool = False
 
-    blank_run = 0
+    blank_run: int = 0
 
     lines = text.splitlines()
     for line in lines:
-        m = code_snip_re.fullmatch(line.strip())
-        if m and 'code_snippet' in enabled_set:
-            lang = (m.group('lang') or 'mermaid').strip()
-            out_lines.append(f"```{lang}")
-            if lang.lower() == 'mermaid':
-                mermaid_open = True
-                mermaid_has_content = False
-            else:
-                generic_fence_open = True
-            blank_run = 0
+        stripped = line.strip()
+
+        # blank lines can never be markers or fences, so handle them first
+        if not stripped:
+            if mermaid_open:
+                if do_close and mermaid_has_content:
+                    append('')
+                    append('```')
+                    append('')
+                    mermaid_open = False
+                    mermaid_has_content = False
+                    blank_run = 1
+                    continue
+                append(line)
+                blank_run += 1
+                continue
+
+            # Normal line handling: collapse excessive blank runs
+            blank_run += 1
+            if not do_collapse or blank_run <= 2:
+                append('')
             continue
 
+        # a stripped marker starts with C/c; skip the regex call for other lines
+        if do_snip and stripped[0] in 'Cc':
+            m = fullmatch(stripped)
+            if m:
+                grp = m.group('lang')
+                if grp is None:
+                    # bare `Code snippet` markers default to mermaid
+                    lang = _MERMAID
+                    is_mermaid = True
+                else:
+                    lang = grp.strip()
+                    is_mermaid = lang.casefold() == _MERMAID
+                append(f"```{lang}")
+                if is_mermaid:
+                    mermaid_open = True
+                    mermaid_has_content = False
+                else:
+                    generic_fence_open = True
+                blank_run = 0
+                continue
+
         # Toggle generic fence state on explicit ``` lines
-        if line.strip().startswith('```'):
-            out_lines.append(line)
-            if 'close_fences' in enabled_set:
+        if stripped.startswith('```'):
+            append(line)
+            if do_close:
                 generic_fence_open = not generic_fence_open
                 if mermaid_open:
                     mermaid_open = False
@@ -73,43 +171,24 @@ def transform_text(text: str, enabled: Iterable[str] | None = None) -> str:
             continue
 
         if mermaid_open:
-            if 'close_fences' in enabled_set and line.strip() == '' and mermaid_has_content:
-                out_lines.append('')
-                out_lines.append('```')
-                out_lines.append('')
-                mermaid_open = False
-                mermaid_has_content = False
-                blank_run = 1
-                continue
-            if line.strip() != '':
-                mermaid_has_content = True
-            out_lines.append(line)
-            blank_run = 0 if line.strip() != '' else blank_run + 1
-            continue
-
-        # Normal line handling: collapse excessive blank runs
-        if line.strip() == '':
-            blank_run += 1
-            if 'collapse_blanks' not in enabled_set or blank_run <= 2:
-                out_lines.append('')
-            continue
-
+            mermaid_has_content = True
         blank_run = 0
-        out_lines.append(line)
+        append(line)
 
     # close any open fences at EOF (if enabled)
-    if 'close_fences' in enabled_set:
+    if do_close:
         if mermaid_open and mermaid_has_content:
-            out_lines.append('')
-            out_lines.append('```')
+            append('')
+            append('```')
             mermaid_open = False
 
         if generic_fence_open:
-            out_lines.append('```')
+            append('```')
             generic_fence_open = False
 
+    # keep the trailing newline without concatenating onto the joined result
     if text.endswith('\n'):
-        return '\n'.join(out_lines) + '\n'
+        append('')
     return '\n'.join(out_lines)
     
 def _download_and_replace_images(text: str, out_dir: Path) -> str:
@@ -120,43 +199,69 @@ def _download_and_replace_images(text: str, out_dir: Path) -> str:
     images_dir = out_dir / "images"
     images_dir.mkdir(parents=True, exist_ok=True)
 
-    # match alt text starting with 'Image of' (case-insensitive)
-    img_re = re.compile(r"!\[Image of[^\]]*\]\((?P<url>https?://[^)\s]+)\)", re.I)
-
-    def _guess_ext(url: str, headers) -> str:
+    def _guess_ext(path: Path, headers) -> str:
         # try from URL path
-        path = urllib.parse.urlparse(url).path
-        base = Path(urllib.parse.unquote(path)).name
-        if "." in base:
-            ext = Path(base).suffix
+        if "." in path.name:
+            ext = path.suffix
             if ext:
                 return ext
         # fallback to content-type header
         ctype = headers.get("content-type") if headers else None
         if ctype:
-            ext = mimetypes.guess_extension(ctype.split(";")[0].strip())
-            if ext:
-                return ext
+            guessed = mimetypes.guess_extension(ctype.split(";")[0].strip())
+            if guessed:
+                return guessed
         return ".img"
 
+    # created here, before the download threads start
+    session = _get_session()
+
+    def _fetch_one(url: str) -> tuple[Path, dict[str, str]] | None:
+        # stream the body into a partial file; it is renamed once named below
+        part = images_dir / f".{_url_hash(url)}.{os.getpid()}.part"
+        try:
+            if session is not None:
+                with session.get(url, timeout=30, stream=True) as resp:
+                    resp.raise_for_status()
+                    headers = {k.lower(): v for k, v in resp.headers.items()}
+                    _write_chunks(part, resp.iter_content(_CHUNK_SIZE))
+            else:
+                req = urllib.request.Request(url, headers={"User-Agent": _USER_AGENT})
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    headers = {k.lower(): v for k, v in resp.getheaders()}
+                    _write_chunks(part, iter(lambda: resp.read(_CHUNK_SIZE), b""))
+        except Exception:
+            part.unlink(missing_ok=True)
+            return None
+        return part, headers
+
+    # fetch each distinct URL concurrently before rewriting the text
+    urls = list(dict.fromkeys(m.group("url") for m in _IMG_RE.finditer(text)))
+    url_to_file: dict[str, tuple[Path, dict[str, str]] | None] = {}
+    if urls:
+        with ThreadPoolExecutor(max_workers=min(_DOWNLOAD_WORKERS, len(urls))) as executor:
+            url_to_file = dict(zip(urls, executor.map(_fetch_one, urls)))
+
     seen_names: dict[str, int] = {}
+    # replacement link per URL already saved; repeated images share one file
+    url_cache: dict[str, str] = {}
 
     def _download(m: re.Match) -> str:
         url = m.group("url")
-        try:
-            req = urllib.request.Request(url, headers={"User-Agent": "transform-md/1.0"})
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                data = resp.read()
-                headers = {k.lower(): v for k, v in resp.getheaders()}
-                ext = _guess_ext(url, headers)
-        except Exception:
+        if url in url_cache:
+            return url_cache[url]
+        fetched = url_to_file.get(url)
+        if fetched is None:
             return m.group(0)  # leave unchanged on failure
+        part, headers = fetched
+        # parse the URL once for both the extension and the filename
+        path = Path(urllib.parse.unquote(urllib.parse.urlparse(url).path))
+        ext = _guess_ext(path, headers)
 
         # derive filename
-        parsed = urllib.parse.urlparse(url)
-        name = Path(urllib.parse.unquote(parsed.path)).stem
+        name = path.stem
         if not name:
-            name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+            name = _url_hash(url)
         # ensure unique
         count = seen_names.get(name, 0)
         seen_names[name] = count + 1
@@ -165,14 +270,20 @@ def _download_and_replace_images(text: str, out_dir: Path) -> str:
         fname = f"{name}{ext}"
         target = images_dir / fname
         try:
-            target.write_bytes(data)
+            os.replace(part, target)
         except Exception:
             return m.group(0)
 
         rel = Path("images") / fname
-        return f"![Image of]({rel.as_posix()})"
+        url_cache[url] = f"![Image of]({rel.as_posix()})"
+        return url_cache[url]
+
+    new_text = _IMG_RE.sub(_download, text)
 
-    new_text = img_re.sub(lambda mm: _download(mm), text)
+    # drop partial files that could not be moved into place
+    for url, fetched in url_to_file.items():
+        if fetched is not None and url not in url_cache:
+            fetched[0].unlink(missing_ok=True)
     return new_text
 
 
@@ -192,6 +303,18 @@ def transform_file(in_path: Path, out_path: Path | None = None, enabled: Iterabl
     out_path.write_text(new_text, encoding="utf-8")
     return out_path
 
+
+def _init_worker(download_workers: int) -> None:
+    """Set the per-process download thread limit in --indir worker processes."""
+    global _DOWNLOAD_WORKERS
+    _DOWNLOAD_WORKERS = download_workers
+
+
+def _process_one(in_path: Path, out_path: Path, enabled: Iterable[str] | None, download_images: bool) -> Path:
+    """Worker for directory mode; module-level so it can be pickled."""
+    return transform_file(in_path, out_path, enabled=enabled, download_images=download_images)
+
+
 def _cli() -> None:
     parser = argparse.ArgumentParser(description="Transform exported Gemini chat markdown to improved markdown.")
     parser.add_argument("input", type=Path, help="Input markdown file")
@@ -230,11 +353,20 @@ def _cli() -> None:
         in_dir: Path = args.indir
         out_dir: Path = args.outdir
         out_dir.mkdir(parents=True, exist_ok=True)
-        written = []
-        for p in sorted(in_dir.glob("*.md")):
-            target = out_dir / p.name
-            transform_file(p, target, enabled=enabled, download_images=args.download_images)
-            written.append(str(target))
+        paths = sorted(in_dir.glob("*.md"))
+        targets = [out_dir / p.name for p in paths]
+        workers = min(os.cpu_count() or 1, len(paths))
+        if workers > 1 and len(paths) >= _PARALLEL_MIN_FILES:
+            # files are independent, so transform them across processes; split the
+            # download threads so all workers together stay within _DOWNLOAD_WORKERS
+            per_worker = max(1, _DOWNLOAD_WORKERS // workers)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(per_worker,)) as executor:
+                results = list(executor.map(
+                    _process_one, paths, targets, repeat(enabled), repeat(args.download_images), chunksize=4
+                ))
+        else:
+            results = [_process_one(p, t, enabled, args.download_images) for p, t in zip(paths, targets)]
+        written = [str(w) for w in results]
         print("Wrote:")
         for w in written:
             print(w)